@@ -0,0 +1,23 @@
+try:
+    from numba import njit
+except ImportError:  # numba é opcional
+    njit = None
+
+# Inclinação de mínimos quadrados pela origem para Z² - Z0² vs t
+# Fica num módulo separado para que o Streamlit o importe uma única vez
+# (o script principal é reexecutado a cada rerun e recriaria o kernel)
+
+
+if njit is not None:
+    @njit(error_model='numpy')
+    def ajustar_inclinacao(t, dz2):
+        s_tt = 0.0
+        s_ty = 0.0
+        for i in range(t.shape[0]):
+            s_tt += t[i] * t[i]
+            s_ty += t[i] * dz2[i]
+        return s_ty / s_tt, s_tt
+else:
+    def ajustar_inclinacao(t, dz2):
+        s_tt = t @ t
+        return (t @ dz2) / s_tt, s_tt
@@ -1,9 +1,22 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Renderização apenas para PNG (sem backend interativo)
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
 import base64
+import hashlib
+import io
+import math
+import threading
+from contextlib import contextmanager
+
+from ajuste import ajustar_inclinacao
+
+# Constantes do modelo de difusão
+R = 8.314  # J/(mol·K)
+P_A1 = 0.66782e5  # Pa (pressão de vapor da acetona a 45°C)
+P_A2 = 0
 
 # Configuração da página
 st.set_page_config(
@@ -80,9 +93,9 @@ with st.sidebar:
             M_A = 44.01
             rho_A = 997.0
 
-        st.info(f"Parâmetros para {sistema}:")
-        st.write(f"- Massa molar: {M_A} g/mol")
-        st.write(f"- Densidade: {rho_A} kg/m³")
+        st.info(f"Parâmetros para {sistema}:\n"
+                f"- Massa molar: {M_A} g/mol\n"
+                f"- Densidade: {rho_A} kg/m³")
 
     # Pressão e temperatura
     P = st.number_input("Pressão total (atm):", value=1.0, step=0.1)
@@ -98,18 +111,25 @@ with st.sidebar:
 def calcular_D_AB_teorico(T, D_AB_ref, T_ref=273.0):
     return D_AB_ref * (T/T_ref)**1.75
 
-# Função modelo para ajuste dos dados experimentais
+# Constante do modelo de difusão: Z² - Z0² = K·D_AB·t
+# (só D_AB varia no ajuste, então o restante é calculado uma única vez)
 
 
-def modelo_diffusao(t, D_AB):
-    R = 8.314  # J/(mol·K)
-    P_A1 = 0.66782e5  # Pa (pressão de vapor da acetona a 45°C)
-    P_A2 = 0
+def calcular_K(M_A, rho_A, T, P):
     P_total = P * 101325  # Convertendo atm para Pa
+    if P_total <= P_A1:
+        raise ValueError(f"a pressão total ({P} atm) deve ser maior que a "
+                         f"pressão de vapor do soluto ({P_A1/101325:.2f} atm)")
+
+    termo = (2 * M_A * P_total) / (rho_A * R * T)
+    log_term = math.log((P_total - P_A2)/(P_total - P_A1))
+    return termo * log_term
 
-    termo = (2 * M_A * D_AB * P_total) / (rho_A * R * T)
-    log_term = np.log((P_total - P_A2)/(P_total - P_A1))
-    return np.sqrt(termo * log_term * t)
+# Função modelo da altura do menisco: Z² - Z0² = K·D_AB·t
+
+
+def modelo_diffusao(t, D_AB, K, z0=0.0):
+    return np.sqrt(z0**2 + K * D_AB * t)
 
 # Processamento de dados
 
@@ -121,15 +141,26 @@ def processar_dados(df):
             st.error("O arquivo CSV deve conter colunas 'tempo' (s) e 'altura' (m)")
             return None
 
+        # Descartar linhas com tempo/altura ausentes (Z0 vem da primeira linha)
+        validas = (np.isfinite(df['tempo'].to_numpy()) &
+                   np.isfinite(df['altura'].to_numpy()))
+        if not validas.any():
+            st.error("O arquivo CSV não contém linhas válidas de 'tempo' e 'altura'")
+            return None
+        if not validas.all():
+            st.warning(f"{(~validas).sum()} linha(s) com valores ausentes "
+                       "foram descartadas")
+            df = df[validas].reset_index(drop=True)
+
         # Converter altura para metros se estiver em cm
-        if df['altura'].max() < 1:  # Assume que está em metros
-            pass
-        else:
-            df['altura'] = df['altura'] / 100  # Convertendo cm para m
+        # (valores abaixo de 1 são assumidos em metros)
+        h = df['altura'].to_numpy()
+        if np.nanmax(h) >= 1.0:
+            h = h / 100  # Convertendo cm para m
+            df['altura'] = h
 
         # Calcular Z² - Z0²
-        z0 = df['altura'].iloc[0]
-        df['delta_z2'] = df['altura']**2 - z0**2
+        df['delta_z2'] = h*h - h[0]*h[0]
 
         return df
 
@@ -138,6 +169,98 @@ def processar_dados(df):
         return None
 
 
+# Leitura e processamento em cache (evita reprocessar o CSV a cada rerun)
+
+
+@st.cache_data
+def carregar_dados(file_bytes):
+    # Tipos explícitos só para as colunas presentes (a validação fica em
+    # processar_dados, que mostra a mensagem de colunas ausentes)
+    colunas = pd.read_csv(io.BytesIO(file_bytes), nrows=0).columns
+    tipos = {c: 'float64' for c in ('tempo', 'altura') if c in colunas}
+    try:
+        df = pd.read_csv(io.BytesIO(file_bytes), engine='pyarrow', dtype=tipos)
+    except ImportError:  # pyarrow não instalado
+        df = pd.read_csv(io.BytesIO(file_bytes), engine='c', dtype=tipos,
+                         low_memory=False)
+    return processar_dados(df)
+
+# Curva ajustada em cache (recalculada só quando D_AB, K ou os dados mudam)
+
+
+@st.cache_data
+def calcular_curva_ajustada(D_AB_exp, t_max, K, z0):
+    t_range = np.linspace(0, t_max, 100)
+    return t_range, modelo_diffusao(t_range, D_AB_exp, K, z0)
+
+# CSV de resultados montado diretamente em memória
+
+
+@st.cache_data
+def gerar_csv_resultados(D_AB_exp, D_AB_teorico, erro_relativo):
+    buf = io.StringIO()
+    buf.write("Parametro,Valor,Unidade\n")
+    buf.write(f"D_AB_Experimental,{D_AB_exp},m²/s\n")
+    buf.write(f"D_AB_Teorico,{D_AB_teorico},m²/s\n")
+    buf.write(f"Erro_Relativo,{erro_relativo},%\n")
+    return buf.getvalue().encode()
+
+# Redução de pontos para gráficos (Largest-Triangle-Three-Buckets)
+# Mantém o formato visual da série limitando o custo de renderização
+
+
+def reduzir_pontos(x, y, n_saida=2000):
+    # Séries pequenas são devolvidas direto, sem passar pelo hash do cache
+    if len(x) <= n_saida or n_saida < 3:
+        return x, y
+    return calcular_lttb(x, y, n_saida)
+
+# LTTB em cache: só é recalculado quando os dados mudam
+
+
+@st.cache_data
+def calcular_lttb(x, y, n_saida):
+    n = len(x)
+
+    # Primeiro e último pontos são mantidos; o restante é dividido em baldes
+    bordas = np.linspace(1, n - 1, n_saida - 1).astype(int)
+    indices = np.empty(n_saida, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    for i in range(n_saida - 2):
+        ini, fim = bordas[i], bordas[i + 1]
+        prox_fim = bordas[i + 2] if i + 2 < len(bordas) else n
+        x_medio = x[fim:prox_fim].mean()
+        y_medio = y[fim:prox_fim].mean()
+
+        # Escolhe o ponto do balde que forma o maior triângulo
+        area = np.abs((x[a] - x_medio) * (y[ini:fim] - y[a]) -
+                      (x[a] - x[ini:fim]) * (y_medio - y[a]))
+        a = ini + np.argmax(area)
+        indices[i + 1] = a
+
+    return x[indices], y[indices]
+
+# Figuras compartilhadas entre reruns e sessões (evita recriar Figure/Axes)
+# A trava impede que duas sessões desenhem na mesma figura ao mesmo tempo
+
+
+@st.cache_resource
+def criar_figura(chave):
+    fig, ax = plt.subplots(figsize=(10, 5))
+    return fig, ax, threading.Lock()
+
+
+@contextmanager
+def obter_figura(chave):
+    fig, ax, trava = criar_figura(chave)
+    with trava:
+        ax.clear()
+        yield fig, ax
+
+
 # Conteúdo principal
 tab1, tab2, tab3 = st.tabs(["Importar Dados", "Simulação", "Resultados"])
 
@@ -149,29 +272,35 @@ with tab1:
 
     if uploaded_file is not None:
         try:
-            df_exp = pd.read_csv(uploaded_file)
+            # Ler e processar dados (reaproveita a sessão se o arquivo não mudou)
+            arquivo_bytes = uploaded_file.getvalue()
+            csv_hash = hashlib.blake2b(arquivo_bytes, digest_size=16).hexdigest()
+            if st.session_state.get('csv_hash') == csv_hash:
+                df_exp = st.session_state.df_exp
+            else:
+                df_exp = carregar_dados(arquivo_bytes)
             st.success("Arquivo carregado com sucesso!")
 
-            # Processar dados
-            df_exp = processar_dados(df_exp)
-
             if df_exp is not None:
                 st.write("Visualização dos dados:")
                 st.dataframe(df_exp.head())
 
                 # Plotar dados brutos
-                fig, ax = plt.subplots(figsize=(10, 5))
-                ax.plot(df_exp['tempo'], df_exp['altura']*100,
-                        'bo-', label='Dados Experimentais')
-                ax.set_xlabel('Tempo (s)')
-                ax.set_ylabel('Altura (cm)')
-                ax.set_title('Variação da Altura do Menisco vs Tempo')
-                ax.grid(True)
-                ax.legend()
-                st.pyplot(fig)
+                t_plot, h_plot = reduzir_pontos(df_exp['tempo'].to_numpy(),
+                                                df_exp['altura'].to_numpy())
+                with obter_figura('fig_raw') as (fig, ax):
+                    ax.plot(t_plot, h_plot*100,
+                            'bo-', label='Dados Experimentais')
+                    ax.set_xlabel('Tempo (s)')
+                    ax.set_ylabel('Altura (cm)')
+                    ax.set_title('Variação da Altura do Menisco vs Tempo')
+                    ax.grid(True)
+                    ax.legend()
+                    st.pyplot(fig)
 
                 # Salvar dados processados na sessão
                 st.session_state.df_exp = df_exp
+                st.session_state.csv_hash = csv_hash
 
         except Exception as e:
             st.error(f"Erro ao ler o arquivo: {str(e)}")
@@ -185,50 +314,65 @@ with tab2:
     else:
         df_exp = st.session_state.df_exp
 
-        # Ajuste de curva para determinar D_AB experimental
+        # Ajuste linear de Z² - Z0² = K·D_AB·t (mínimos quadrados pela origem)
         try:
-            popt, pcov = curve_fit(modelo_diffusao,
-                                   df_exp['tempo'],
-                                   df_exp['altura'],
-                                   p0=[1e-5])  # Valor inicial para D_AB
+            K = calcular_K(M_A, rho_A, T, P)
+            t = df_exp['tempo'].to_numpy()
+            h = df_exp['altura'].to_numpy()
+            dz2 = df_exp['delta_z2'].to_numpy()
+
+            if not (np.isfinite(t).all() and np.isfinite(dz2).all()):
+                raise ValueError("os dados contêm valores ausentes ou "
+                                 "não numéricos")
+            if len(t) < 2 or not np.any(t):
+                raise ValueError("são necessários ao menos dois pontos, "
+                                 "com algum tempo diferente de zero")
+            z0 = h[0]
+
+            inclinacao, s_tt = ajustar_inclinacao(t, dz2)
+            D_AB_exp = inclinacao / K
+
+            # Desvio padrão de D_AB a partir dos resíduos
+            residuos = dz2 - inclinacao * t
+            var_inclinacao = (residuos @ residuos) / (len(t) - 1) / s_tt
+            D_AB_desvio = np.sqrt(var_inclinacao) / abs(K)
 
-            D_AB_exp = popt[0]
             st.session_state.D_AB_exp = D_AB_exp
 
             # Calcular valores ajustados
-            t_range = np.linspace(0, df_exp['tempo'].max(), 100)
-            h_ajustado = modelo_diffusao(t_range, D_AB_exp)
+            t_range, h_ajustado = calcular_curva_ajustada(
+                D_AB_exp, t.max(), K, z0)
 
             # Plotar ajuste
-            fig, ax = plt.subplots(figsize=(10, 5))
-            ax.plot(df_exp['tempo'], df_exp['altura'] *
-                    100, 'bo', label='Dados Experimentais')
-            ax.plot(t_range, h_ajustado*100, 'r-',
-                    label=f'Ajuste (D_AB = {D_AB_exp:.2e} m²/s)')
-            ax.set_xlabel('Tempo (s)')
-            ax.set_ylabel('Altura (cm)')
-            ax.set_title('Ajuste de Curva para Determinar D_AB')
-            ax.grid(True)
-            ax.legend()
-            st.pyplot(fig)
+            t_plot, h_plot = reduzir_pontos(t, h)
+            with obter_figura('fig_ajuste') as (fig, ax):
+                ax.plot(t_plot, h_plot*100, 'bo', label='Dados Experimentais')
+                ax.plot(t_range, h_ajustado*100, 'r-',
+                        label=f'Ajuste (D_AB = {D_AB_exp:.2e} ± {D_AB_desvio:.1e} m²/s)')
+                ax.set_xlabel('Tempo (s)')
+                ax.set_ylabel('Altura (cm)')
+                ax.set_title('Ajuste de Curva para Determinar D_AB')
+                ax.grid(True)
+                ax.legend()
+                st.pyplot(fig)
 
             # Plotar Z² vs tempo
-            fig2, ax2 = plt.subplots(figsize=(10, 5))
-            ax2.plot(df_exp['tempo'], df_exp['delta_z2'],
-                     'go-', label='Dados Experimentais')
+            t_plot, dz2_plot = reduzir_pontos(t, dz2)
 
             # Calcular linha teórica
-            z2_teorico = modelo_diffusao(
-                df_exp['tempo'], D_AB_exp)**2 - df_exp['altura'].iloc[0]**2
-            ax2.plot(df_exp['tempo'], z2_teorico,
-                     'm--', label='Modelo Teórico')
-
-            ax2.set_xlabel('Tempo (s)')
-            ax2.set_ylabel('Z² - Z0² (m²)')
-            ax2.set_title('Análise de Difusão: Z² vs Tempo')
-            ax2.grid(True)
-            ax2.legend()
-            st.pyplot(fig2)
+            z2_teorico = K * D_AB_exp * t_plot
+
+            with obter_figura('fig_z2') as (fig2, ax2):
+                ax2.plot(t_plot, dz2_plot, 'go-', label='Dados Experimentais')
+                ax2.plot(t_plot, z2_teorico,
+                         'm--', label='Modelo Teórico')
+
+                ax2.set_xlabel('Tempo (s)')
+                ax2.set_ylabel('Z² - Z0² (m²)')
+                ax2.set_title('Análise de Difusão: Z² vs Tempo')
+                ax2.grid(True)
+                ax2.legend()
+                st.pyplot(fig2)
 
         except Exception as e:
             st.error(f"Erro no ajuste de curva: {str(e)}")
@@ -283,11 +427,8 @@ with tab3:
         # Exportar resultados
         st.download_button(
             label="📥 Exportar Resultados (CSV)",
-            data=pd.DataFrame({
-                'Parametro': ['D_AB_Experimental', 'D_AB_Teorico', 'Erro_Relativo'],
-                'Valor': [D_AB_exp, D_AB_teorico_ajustado, erro_relativo],
-                'Unidade': ['m²/s', 'm²/s', '%']
-            }).to_csv(index=False),
+            data=gerar_csv_resultados(D_AB_exp, D_AB_teorico_ajustado,
+                                      erro_relativo),
             file_name="resultados_difusao.csv",
             mime="text/csv"
         )